@@ -79,8 +79,7 @@ def run(
         )
         transcript = converter.speech_to_text()
         usage["audio cost"] = converter.get_audio_usage()
-    with open("trans.txt", "w") as f:
-        f.write(str(transcript))
+
     # Use class ReportGenerator to generate summary reports
     generator = ReportGenerator(
         transcript=transcript,
@@ -9,8 +9,11 @@ Attributes:
 
 Methods:
     generate_report(): Generates a report from the transcript data.
-    _count_tokens(content, model): Counts the number of tokens in the given content using the specified language model.
-    _split_large_text(large_text, max_tokens): Splits a large text into smaller chunks of a specified maximum token length.
+    _get_encoding(model): Gets the tiktoken encoding for the specified language model, cached per model.
+    _count_tokens(content, model, tokens): Counts the number of tokens in the given content using the specified language model,
+        reusing already encoded tokens if given.
+    _split_large_text(large_text, max_tokens, tokens): Splits a large text into smaller chunks of a specified maximum token length,
+        reusing already encoded tokens if given.
 
 Raises:
     NotImplementedError: If the specified model is not supported.
@@ -31,12 +34,42 @@ Example:
 
 import re
 import math
+import time
+import random
 import logging
-from typing import List, Tuple
+import functools
+from typing import List, Optional, Tuple
 
 import tiktoken
 from parallel_process_utils.api_parallel_processor import ParallelProcessor
 
+# Maximum context length (in tokens) of known OpenAI chat models
+MODEL_LIMITS = {
+    "gpt-3.5-turbo": 16385,
+    "gpt-3.5-turbo-16k": 16385,
+    "gpt-4": 8192,
+    "gpt-4-32k": 32768,
+    "gpt-4-turbo": 128000,
+    "gpt-4o": 128000,
+    "gpt-4o-mini": 128000,
+}
+
+# Matches the context length reported in OpenAI's "too many tokens" error message
+CONTEXT_LENGTH_PATTERN = re.compile(r"This model's maximum context length is (\d+)")
+
+# Prompt templates and system prompts sent to the chat model, built once at import
+PREPROCESS_PROMPT = (
+    "會議逐字稿：\n「{chunk}」\n你的任務是將以上會議逐字稿寫成1000字長篇會議紀錄敘述段落，        "
+    "我要你詳細記錄所有提到的事項和重要內容，格式是敘述式段落，你的回應以此開頭：在這次會議中...\n        "
+)
+PREPROCESS_SYSTEM_PROMPT = "你是一個會議逐字稿整理專家，專門將會議逐字稿內容寫成會議紀錄敘述段落"
+REPORT_PROMPT = (
+    "會議紀錄：\n「{data}」\n你的任務是從以上會議紀錄摘要出討論的事件和相應事件的重點敘述，根據討論內容來數字逐列事件，要重點敘述該事件的重點        "
+    "根據會議紀錄中的每件事情適當分類說明\n會議摘要格式：\n1.[事件標題]：\n- 事件重點說明...\n2.[事件標題]：\n- 事件重點說明...        "
+    "\n我要你潤飾文字和修正錯字，並且寫易讀性高的會議摘要\n你的回應以此開頭：1 ..."
+)
+REPORT_SYSTEM_PROMPT = "你是一個會議紀錄分析師，你會根據會議紀錄來數字條列出會議中的事件並重點敘述每一項事件"
+
 
 class ReportGenerator:
     """A class for generating reports using OpenAI's ChatCompletion API."""
@@ -61,6 +94,7 @@ class ReportGenerator:
         self.model = model
         self.prompt_tokens = 0
         self.completion_tokens = 0
+        self.cached_prompt_tokens = 0
         self.api_key = api_key
         logging.basicConfig(level=logging_level)
         self.processor = ParallelProcessor(
@@ -75,18 +109,19 @@ class ReportGenerator:
     def _openai_parallel_request(
         self,
         prompt_list: list,
-        system_prompt_list: list,
+        system_prompt: str,
         max_token: int = 1000,
         temperature: float = 0.0,
         max_attempts: int = 3,
     ) -> list:
         """
         Use the Parallel-Processor package to send parallel requests to the OpenAI API and return responses from the assistant.
-        If the response structure is unexpected, the function will attempt to call the API again, up to a maximum number of attempts.
+        If the response structure is unexpected, the function will attempt to call the API again, up to a maximum number of attempts,
+        waiting with exponential backoff and random jitter between attempts.
 
         Args:
             prompt_list (list): A list of prompts for the assistant.
-            system_prompt_list (list): A list of system prompts for the assistant.
+            system_prompt (str): The system prompt shared by every request.
             max_token (int, optional): The maximum number of tokens that the model can generate. Defaults to 1000.
             temperature (float, optional): The temperature parameter for the model, controlling the randomness of the output. Defaults to 0.0.
             max_attempts (int, optional): The maximum number of attempts to call the API if the response structure is unexpected. Defaults to 3.
@@ -94,21 +129,20 @@ class ReportGenerator:
         Returns:
             list: A list of the assistant's responses.
         """
+        # Every request references the same system message, so the prompt prefix is identical
+        system_message = {"role": "system", "content": system_prompt}
+        requests_data = [
+            {
+                "model": self.model,
+                "messages": [system_message, {"role": "user", "content": prompt}],
+                "max_tokens": max_token,
+                "temperature": temperature,
+            }
+            for prompt in prompt_list
+        ]
         for attempt in range(max_attempts):
-            requests_data = [
-                {
-                    "model": self.model,
-                    "messages": [
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": prompt},
-                    ],
-                    "max_tokens": max_token,
-                    "temperature": temperature,
-                }
-                for prompt, system_prompt in zip(prompt_list, system_prompt_list)
-            ]
             response = self.processor.parallel_request(requests_data=requests_data)
-            logging.info(f"parallel response:{response}")
+            logging.debug("parallel response: %s", response)
 
             try:
                 # Extract assistant's responses
@@ -123,17 +157,27 @@ class ReportGenerator:
                 self.completion_tokens += sum(
                     item[2]["usage"]["completion_tokens"] for item in response
                 )
+                # Prompt tokens served from OpenAI's prompt cache are billed at a lower rate
+                self.cached_prompt_tokens += sum(
+                    (item[2]["usage"].get("prompt_tokens_details") or {}).get(
+                        "cached_tokens", 0
+                    )
+                    for item in response
+                )
 
                 return assistant_responses
             except Exception as e:
                 logging.error(f"Attempt {attempt+1} failed with error: {e}")
                 if attempt + 1 == max_attempts:
                     raise e
+                # Back off exponentially with jitter so retries after rate limits don't collide
+                time.sleep(min(60, 2**attempt + random.random()))
 
     def _get_model_limit(self) -> int:
         """
         This method is used to get the maximum context length (in tokens) that a specific OpenAI model can handle.
-        It sends a request with an intentionally large number of tokens, then parses the error message to find the model's limit.
+        Known models are looked up in MODEL_LIMITS. For other models it sends a request with an intentionally
+        large number of tokens, then parses the error message to find the model's limit.
 
         Returns:
             int: The maximum context length (in tokens) that the model can handle.
@@ -141,6 +185,9 @@ class ReportGenerator:
         Raises:
             ValueError: If the error message does not contain the expected information.
         """
+        if self.model in MODEL_LIMITS:
+            return MODEL_LIMITS[self.model] - 100
+
         # Set up logging
         logger = logging.getLogger(__name__)
         logger.setLevel(logging.ERROR)
@@ -163,9 +210,7 @@ class ReportGenerator:
         try:
             response = self.processor.parallel_request(requests_data=requests_data)
             error_message = response[0][2]["error"]["message"]
-            match = re.search(
-                r"This model's maximum context length is (\d+)", error_message
-            )
+            match = CONTEXT_LENGTH_PATTERN.search(error_message)
             if match:
                 max_context_length = int(match.group(1))- 100
                 logging.info(max_context_length)
@@ -186,8 +231,8 @@ class ReportGenerator:
 
         This function calculates the total tokens in the input data and splits it into chunks. Each chunk is 
         designed to be within the model's token limit when combined with completion and prompt tokens. If the 
-        total tokens are within the model limit, the function returns the whole transcript. The function also 
-        adjusts the size of other chunks if the last chunk is smaller than the minimum chunk length.
+        total tokens are within the model limit, the function returns the whole transcript. Otherwise the tokens 
+        are spread evenly over the fewest chunks that fit, so the last chunk is never much smaller than the others.
 
         Args:
             split_data (str): The input data to be split into chunks.
@@ -197,14 +242,16 @@ class ReportGenerator:
             bool: A boolean value indicating whether the total tokens are within the model limit.
         """
 
-        # Constants for completion and prompt tokens, and minimum chunk length
+        # Constants for completion and prompt tokens
         COMPLETION_TOKEN = 1000
         PROMPT_TOKEN = 200
-        CHUNK_MIN_LENGTH = 1000
         pass_limit = False
 
+        # Encode the transcript once and reuse the tokens for counting and splitting
+        tokens = self._get_encoding("gpt-3.5-turbo-0613").encode(split_data)
+
         # Calculate total tokens in the transcript including completion and prompt tokens
-        transcript_token = self._count_tokens(split_data)
+        transcript_token = self._count_tokens(split_data, tokens=tokens)
         total_tokens = transcript_token + COMPLETION_TOKEN + PROMPT_TOKEN
         logging.info(f"tokens:{transcript_token}")
         logging.info(f"tokens:{total_tokens}")
@@ -217,20 +264,14 @@ class ReportGenerator:
         # Calculate the maximum number of tokens that can be used for the transcript in each chunk
         available_chunk_space = self.model_limit - COMPLETION_TOKEN - PROMPT_TOKEN
 
-        # Calculate the number of tokens in the last chunk
-        last_chunk_space = transcript_token % available_chunk_space
-
-        # If the last chunk is smaller than the minimum chunk length, adjust the size of other chunks
-        if last_chunk_space < CHUNK_MIN_LENGTH:
-            space_for_remaining_chunks = transcript_token - CHUNK_MIN_LENGTH
-            best_chunk = math.ceil(
-                space_for_remaining_chunks / (transcript_token // available_chunk_space)
-            )
-        else:
-            best_chunk = available_chunk_space
+        # Spread the tokens evenly over the fewest chunks that fit, so the last chunk is never too small
+        num_chunks = math.ceil(len(tokens) / available_chunk_space)
+        best_chunk = math.ceil(len(tokens) / num_chunks)
 
         # Split the transcript into chunks
-        chunks = self._split_large_text(large_text=split_data, max_tokens=best_chunk)
+        chunks = self._split_large_text(
+            large_text=split_data, max_tokens=best_chunk, tokens=tokens
+        )
         logging.info(f"Best chunk size:{best_chunk} tokens")
         logging.info(f"Chunk length:{len(chunks)}")
         return chunks, pass_limit
@@ -248,16 +289,17 @@ class ReportGenerator:
         The function logs the start and successful completion of the preprocessing task.
         """
         logging.info("Start preprocessing transcripts.")
-        CONTENT = """會議逐字稿：\n「{chunk}」\n你的任務是將以上會議逐字稿寫成1000字長篇會議紀錄敘述段落，\
-        我要你詳細記錄所有提到的事項和重要內容，格式是敘述式段落，你的回應以此開頭：在這次會議中...
-        """
-        prompt_list = [CONTENT.format(chunk=c) for c in chunks]
-        system_prompt_list = [
-            "你是一個會議逐字稿整理專家，專門將會議逐字稿內容寫成會議紀錄敘述段落" for _ in range(len(chunks))
-        ]
-        summary_list = self._openai_parallel_request(
-            prompt_list=prompt_list, system_prompt_list=system_prompt_list
+        # Summarize each distinct chunk once, then map the summaries back to every position
+        unique_chunks = list(dict.fromkeys(chunks))
+        if chunks:
+            dedup_ratio = 1 - len(unique_chunks) / len(chunks)
+            logging.info(f"Chunk dedup ratio: {dedup_ratio:.2%}")
+        prompt_list = [PREPROCESS_PROMPT.format(chunk=c) for c in unique_chunks]
+        unique_summaries = self._openai_parallel_request(
+            prompt_list=prompt_list, system_prompt=PREPROCESS_SYSTEM_PROMPT
         )
+        summary_by_chunk = dict(zip(unique_chunks, unique_summaries))
+        summary_list = [summary_by_chunk[c] for c in chunks]
         logging.info("Transcript preprocessed successfully.")
         return summary_list
 
@@ -274,14 +316,10 @@ class ReportGenerator:
         The function logs the successful generation of the report content.
         """
         logging.info("Start generating report content.")
-        content = """會議紀錄：\n「{data}」\n你的任務是從以上會議紀錄摘要出討論的事件和相應事件的重點敘述，根據討論內容來數字逐列事件，要重點敘述該事件的重點\
-        根據會議紀錄中的每件事情適當分類說明\n會議摘要格式：\n1.[事件標題]：\n- 事件重點說明...\n2.[事件標題]：\n- 事件重點說明...\
-        \n我要你潤飾文字和修正錯字，並且寫易讀性高的會議摘要\n你的回應以此開頭：1 ..."""
-        prompt = content.format(data=data)
-        system_prompt = "你是一個會議紀錄分析師，你會根據會議紀錄來數字條列出會議中的事件並重點敘述每一項事件"
+        prompt = REPORT_PROMPT.format(data=data)
         report_content = self._openai_parallel_request(
             prompt_list=[prompt],
-            system_prompt_list=[system_prompt],
+            system_prompt=REPORT_SYSTEM_PROMPT,
             max_token=2000,
         )
         logging.info("Summary generated successfully.")
@@ -292,11 +330,12 @@ class ReportGenerator:
         Retrieves the usage statistics of the instance.
 
         Returns:
-            dict: A dictionary with keys 'prompt tokens' and 'completion tokens', and their respective usage counts as values.
+            dict: A dictionary with keys 'prompt tokens', 'cached prompt tokens' and 'completion tokens', and their respective usage counts as values.
         """
         return {
             "text model": self.model,
             "prompt tokens": self.prompt_tokens,
+            "cached prompt tokens": self.cached_prompt_tokens,
             "completion tokens": self.completion_tokens,
         }
 
@@ -323,13 +362,36 @@ class ReportGenerator:
         return report_content[0]
 
     @staticmethod
-    def _count_tokens(content: str, model: str = "gpt-3.5-turbo-0613") -> int:
+    @functools.lru_cache(maxsize=None)
+    def _get_encoding(model: str) -> tiktoken.Encoding:
+        """
+        Get the tiktoken encoding for the specified language model, cached per model.
+
+        Args:
+            model (str): The language model to get the encoding for.
+
+        Returns:
+            tiktoken.Encoding: The encoding used by the model, or cl100k_base if the model is unknown.
+        """
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            print("Warning: model not found. Using cl100k_base encoding.")
+            return tiktoken.get_encoding("cl100k_base")
+
+    @staticmethod
+    def _count_tokens(
+        content: str,
+        model: str = "gpt-3.5-turbo-0613",
+        tokens: Optional[List[int]] = None,
+    ) -> int:
         """
         Count the number of tokens in the given content using the specified language model.
 
         Args:
             content (str): The content to count tokens for.
             model (str, optional): The language model to use (default is "gpt-3.5-turbo-0613").
+            tokens (list, optional): The already encoded content, if available, to avoid encoding it again.
 
         Returns:
             int: The total number of tokens in the content.
@@ -337,17 +399,14 @@ class ReportGenerator:
         Raises:
             NotImplementedError: If the specified model is not supported.
         """
-        messages = [
-            {
-                "role": "user",
-                "content": content,
-            },
-        ]
-        try:
-            encoding = tiktoken.encoding_for_model(model)
-        except KeyError:
-            print("Warning: model not found. Using cl100k_base encoding.")
-            encoding = tiktoken.get_encoding("cl100k_base")
+        # Resolve model aliases to the snapshot whose message format they share
+        model = {
+            "gpt-3.5-turbo": "gpt-3.5-turbo-0613",
+            "gpt-3.5-turbo-16k": "gpt-3.5-turbo-16k-0613",
+            "gpt-4": "gpt-4-0613",
+            "gpt-4-32k": "gpt-4-32k-0613",
+        }.get(model, model)
+        encoding = ReportGenerator._get_encoding(model)
         if model in {
             "gpt-3.5-turbo-0613",
             "gpt-3.5-turbo-16k-0613",
@@ -357,48 +416,36 @@ class ReportGenerator:
             "gpt-4-32k-0613",
         }:
             tokens_per_message = 3
-            tokens_per_name = 1
         elif model == "gpt-3.5-turbo-0301":
             tokens_per_message = 4
-            tokens_per_name = -1
         else:
             raise NotImplementedError(
                 f"""num_tokens_from_messages() is not implemented for model {model}."""
             )
-        num_tokens = 0
-        for message in messages:
-            num_tokens += tokens_per_message
-            for key, value in message.items():
-                num_tokens += len(encoding.encode(value))
-                if key == "name":
-                    num_tokens += tokens_per_name
-        num_tokens += 3
-        return num_tokens
+        if tokens is None:
+            tokens = encoding.encode(content)
+
+        # The content is sent as a single user message, plus 3 tokens priming the assistant reply
+        return tokens_per_message + len(encoding.encode("user")) + len(tokens) + 3
 
     @staticmethod
-    def _split_large_text(large_text: str, max_tokens: int) -> list:
+    def _split_large_text(
+        large_text: str, max_tokens: int, tokens: Optional[List[int]] = None
+    ) -> list:
         """
         Splits a large text into smaller chunks of a specified maximum token length.
 
         Args:
             large_text (str): The large text that needs to be split into smaller chunks.
             max_tokens (int): The maximum number of tokens that each chunk of text can contain.
+            tokens (list, optional): The already encoded text, if available, to avoid encoding it again.
 
         Returns:
             list: A list of text chunks, each containing no more than the specified maximum number of tokens.
         """
         enc = tiktoken.get_encoding("cl100k_base")
-        tokenized_text = enc.encode(large_text)
-        chunks = []
-        current_chunk = []
-        current_length = 0
-        for token in tokenized_text:
-            current_chunk.append(token)
-            current_length += 1
-            if current_length >= max_tokens:
-                chunks.append(enc.decode(current_chunk).rstrip(" .,;"))
-                current_chunk = []
-                current_length = 0
-        if current_chunk:
-            chunks.append(enc.decode(current_chunk).rstrip(" .,;"))
-        return chunks
+        tokenized_text = tokens if tokens is not None else enc.encode(large_text)
+        return [
+            enc.decode(tokenized_text[i : i + max_tokens]).rstrip(" .,;")
+            for i in range(0, len(tokenized_text), max_tokens)
+        ]
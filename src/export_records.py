@@ -21,10 +21,11 @@ Example:
 """
 
 import os
-import json
 import logging
 from typing import Optional
 
+import orjson
+
 
 class ReportExporter:
     """
@@ -63,7 +64,10 @@ class ReportExporter:
 
         if output_path is None:
             output_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        if output_path:
+            os.makedirs(output_path, exist_ok=True)
         self.output_path = output_path
+        self._base_path = os.path.join(output_path, "")
         self.meeting_name = meeting_name
         self.summary = summary
         self.usage = usage
@@ -83,12 +87,11 @@ class ReportExporter:
             Exception: If there is an error in exporting the text file.
         """
         try:
-            filename = f"{self.meeting_name}.txt"
-            filepath = os.path.join(self.output_path, filename)
+            filepath = f"{self._base_path}{self.meeting_name}.txt"
+            report = f"#{self.meeting_name}\n\n##會議重點\n{self.summary}"
+            if show_cost:
+                report += f"\n\n##費用資訊\n{str(self.usage)}"
             with open(filepath, "w", encoding="utf-8") as file:
-                report = f"#{self.meeting_name}\n\n##會議重點\n{self.summary}"                
-                if show_cost:
-                    report += f"\n\n##費用資訊\n{str(self.usage)}"
                 file.write(report)
             logging.info(f"Successfully exported text file: {filepath}")
             return report
@@ -103,16 +106,15 @@ class ReportExporter:
             Exception: If there is an error in exporting the JSON file.
         """
         try:
-            filename = f"{self.meeting_name}.json"
-            filepath = os.path.join(self.output_path, filename)
+            filepath = f"{self._base_path}{self.meeting_name}.json"
             data = {
                 "meeting_name": self.meeting_name,
                 "summary": self.summary,
             }
             if self.usage:
                 data["usage"] = self.usage
-            with open(filepath, "w", encoding="utf-8") as json_file:
-                json.dump(data, json_file)
+            with open(filepath, "wb") as json_file:
+                json_file.write(orjson.dumps(data))
             logging.info(f"Successfully exported JSON file: {filepath}")
         except Exception as e:
             logging.warning(f"Failed to export JSON file: {e}")
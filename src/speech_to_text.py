@@ -23,13 +23,18 @@ import os
 import math
 import logging
 import shutil
-from typing import Tuple, Optional
+import functools
+import threading
+import subprocess
+from typing import TYPE_CHECKING, Generator, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
 
-import openai
-import whisper
 from openai import OpenAI
 from pydub import AudioSegment
 
+if TYPE_CHECKING:
+    import whisper
+
 
 class SpeechToTextConverter:
     """
@@ -63,7 +68,9 @@ class SpeechToTextConverter:
         self.save_transcript = save_transcript
         self.output_path = output_path
         self.audio_minutes = 0
-        openai.api_key = api_key
+        # One client per converter, so converters with different keys don't overwrite each other
+        # and segment uploads reuse its pooled connections
+        self.client = OpenAI(api_key=api_key)
         logging.basicConfig(level=logging_level)
 
     def _convert_by_api(self) -> str:
@@ -73,22 +80,42 @@ class SpeechToTextConverter:
         Returns:
             str: The transcribed text from the audio file.
         """
-        # Convert the specified audio file to mp3,
-        mp3_path, remove_mp3 = self._convert_to_mp3(self.file_path)
-        mp3_dir_path = self._split_audio(mp3_path)
-
-        # Traverse mp3 audio file folder
-        client = OpenAI()
-        transcript_list = []
-        for file_name in sorted(os.listdir(mp3_dir_path)):
-            # The audio file currently to be converted
-            input_file = os.path.join(mp3_dir_path, file_name)
-            # Convert speech to text and add the results to the transcript list
-            transcript_list.append(
-                client.audio.transcriptions.create(
-                    model="whisper-1", file=open(input_file, "rb")
-                ).text
-            )
+        # Check whether the audio file has to be encoded to mp3 while it is split
+        encode_mp3, bit_rate = self._needs_mp3_encoding(self.file_path)
+        mp3_dir_path = os.path.join(
+            os.path.dirname(self.file_path),
+            f"{os.path.splitext(os.path.basename(self.file_path))[0]}_segments",
+        )
+
+        # Transcribe each segment as soon as ffmpeg has written it, keeping their order
+        MAX_WORKERS = 8
+        segments = self._split_audio(
+            self.file_path, mp3_dir_path, encode_mp3=encode_mp3, bit_rate=bit_rate
+        )
+        futures = []
+        try:
+            with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+                try:
+                    for segment_path in segments:
+                        # Stop splitting as soon as an upload has failed
+                        for future in futures:
+                            if future.done() and future.exception():
+                                raise future.exception()
+                        futures.append(
+                            executor.submit(
+                                self._transcribe_segment, self.client, segment_path
+                            )
+                        )
+                    transcript_list = [future.result() for future in futures]
+                except Exception:
+                    # Don't upload, and pay for, segments whose transcripts would be thrown away
+                    for future in futures:
+                        future.cancel()
+                    raise
+        finally:
+            # Stop ffmpeg if splitting was interrupted, then clear temporary audio files
+            segments.close()
+            self._clear_tempfile(mp3_dir_path)
 
         # Merge all results in list
         combined_transcript = "\n".join(transcript_list)
@@ -104,9 +131,6 @@ class SpeechToTextConverter:
             with open(transcriptions_path, "w", encoding="utf-8") as file:
                 file.write(combined_transcript)
 
-        # Clear temporary audio files
-        self._clear_tempfile(mp3_dir_path, mp3_path, remove_mp3)
-
         return combined_transcript
 
     def _convert_by_model(self, model: str) -> str:
@@ -128,8 +152,10 @@ class SpeechToTextConverter:
             model_path = os.path.join(current_file_path, "whisper_model")
 
             # Use the specified model to convert speech to text
-            model = whisper.load_model(model, download_root=model_path)
-            result = model.transcribe(self.file_path)
+            model, model_lock = self._load_whisper_model(model, model_path)
+            # The cached model is shared across threads, and transcribe() isn't safe to run on it concurrently
+            with model_lock:
+                result = model.transcribe(self.file_path)
             transcript = result["text"]
             logging.info("Complete speech to text: %s", transcript)
 
@@ -161,12 +187,13 @@ class SpeechToTextConverter:
         Returns:
             dict: The duration of the audio file in minutes and audio model type.
         """
-        try:
-            audio = AudioSegment.from_file(self.file_path)
-        except FileNotFoundError as error:
-            raise FileNotFoundError("Can't found audio file.") from error
+        if not os.path.isfile(self.file_path):
+            raise FileNotFoundError("Can't found audio file.")
 
-        duration_seconds = len(audio) / 1000
+        stat = os.stat(self.file_path)
+        duration_seconds = self._get_audio_duration(
+            self.file_path, stat.st_mtime_ns, stat.st_size
+        )
         duration_minutes = math.ceil(duration_seconds / 60)
         return {"audio model": self.model, "audio minutes": duration_minutes}
 
@@ -195,101 +222,306 @@ class SpeechToTextConverter:
             raise ValueError(e)
 
     @staticmethod
-    def _convert_to_mp3(file_path: str) -> Tuple[Optional[str], bool]:
+    @functools.lru_cache(maxsize=4)
+    def _load_whisper_model(
+        model: str, download_root: str
+    ) -> Tuple["whisper.Whisper", threading.Lock]:
+        """
+        Loads a local Whisper model, caching it so repeated transcriptions in one process load the weights only once.
+        whisper (and torch with it) is imported here so API-only runs never pay for it.
+        The model is cached with a lock that callers must hold while transcribing, because one instance
+        is shared by every thread in the process and concurrent transcribe() calls corrupt each other.
+
+        Args:
+            model (str): The name of the Whisper model to be loaded.
+            download_root (str): The directory where the model weights are stored.
+
+        Returns:
+            Tuple[whisper.Whisper, threading.Lock]: The loaded Whisper model and the lock guarding it.
+        """
+        import whisper
+
+        return (
+            whisper.load_model(model, download_root=download_root),
+            threading.Lock(),
+        )
+
+    @staticmethod
+    @functools.lru_cache(maxsize=128)
+    def _get_audio_duration(file_path: str, mtime_ns: int, size: int) -> float:
+        """
+        Reads the duration of an audio file, cached on its path, modification time and size
+        so reruns on an unchanged file skip probing it again.
+
+        Args:
+            file_path (str): The path to the audio file.
+            mtime_ns (int): The file's modification time in nanoseconds, used only as a cache key.
+            size (int): The file's size in bytes, used only as a cache key.
+
+        Returns:
+            float: The duration of the audio file in seconds.
+        """
+        # Read the duration from the container header instead of decoding the whole file
+        output = subprocess.check_output(
+            [
+                "ffprobe",
+                "-v",
+                "error",
+                "-show_entries",
+                "format=duration",
+                "-of",
+                "default=noprint_wrappers=1:nokey=1",
+                file_path,
+            ],
+            text=True,
+        )
+        try:
+            duration_seconds = float(output)
+        except ValueError:
+            # Some containers don't store a duration, so fall back to decoding the audio
+            duration_seconds = len(AudioSegment.from_file(file_path)) / 1000
+        return duration_seconds
+
+    @staticmethod
+    def _get_bit_rate(file_path: str) -> Optional[int]:
+        """
+        Reads the overall bitrate of an audio file from its container header.
+
+        Args:
+            file_path (str): The path to the audio file.
+
+        Returns:
+            Optional[int]: The bitrate in bits per second, or None if the container doesn't report one.
+        """
+        output = subprocess.check_output(
+            [
+                "ffprobe",
+                "-v",
+                "error",
+                "-show_entries",
+                "format=bit_rate",
+                "-of",
+                "default=noprint_wrappers=1:nokey=1",
+                file_path,
+            ],
+            text=True,
+        )
+        try:
+            return int(output)
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _transcribe_segment(client: OpenAI, segment_path: str) -> str:
+        """
+        Transcribes a single audio segment using the OpenAI Whisper API.
+
+        Args:
+            client (OpenAI): The OpenAI client used to send the request.
+            segment_path (str): The path of the audio segment to be transcribed.
+
+        Returns:
+            str: The transcribed text of the audio segment.
         """
-        Converts a given audio file to MP3 format.
+        with open(segment_path, "rb") as audio_file:
+            return client.audio.transcriptions.create(
+                model="whisper-1", file=audio_file
+            ).text
 
-        This method checks if the file exists and is in a supported format. If the file is not in MP3 format, it converts the file to MP3.
+    @staticmethod
+    def _is_mp3(file_path: str) -> bool:
+        """
+        Checks whether a file holds MP3 audio by sniffing its header instead of trusting its extension.
 
         Args:
-            file_path (str): The path of the file to be converted.
+            file_path (str): The path of the audio file to be checked.
 
         Returns:
-            Tuple[Optional[str], bool]: A tuple containing the path of the converted MP3 file (or None if the conversion failed), and a boolean indicating whether the original file was converted to MP3.
+            bool: True if the audio starts with an MPEG Layer III frame header, after any ID3v2 tag.
         """
-        remove_mp3 = False
+        with open(file_path, "rb") as file:
+            header = file.read(10)
+            if len(header) == 10 and header[:3] == b"ID3":
+                # AAC and FLAC files can carry ID3v2 tags too, so skip the tag and check the audio behind it.
+                # The tag size is a syncsafe integer (7 bits per byte) and excludes the header and optional footer.
+                tag_size = (
+                    (header[6] & 0x7F) << 21
+                    | (header[7] & 0x7F) << 14
+                    | (header[8] & 0x7F) << 7
+                    | (header[9] & 0x7F)
+                )
+                footer_size = 10 if header[5] & 0x10 else 0
+                file.seek(10 + tag_size + footer_size)
+                header = file.read(2)
+        # Frame sync (11 set bits) followed by the Layer III bits, which rules out AAC ADTS headers
+        return len(header) >= 2 and header[0] == 0xFF and header[1] & 0xE6 == 0xE2
 
+    @staticmethod
+    def _needs_mp3_encoding(file_path: str) -> Tuple[bool, Optional[int]]:
+        """
+        Checks whether an audio file has to be encoded to MP3 before it can be uploaded to the Whisper API.
+
+        Files that the Whisper API accepts as they are (MP3, M4A and WebM) can be split without re-encoding, as long as
+        their bitrate is known and at most 320 kbps. MP3 audio is recognized by its header, so it is not re-encoded even
+        when the file has another extension. Higher-bitrate audio, such as lossless ALAC in M4A, and other supported
+        formats are encoded to MP3 while they are split.
+
+        Args:
+            file_path (str): The path of the audio file to be checked.
+
+        Returns:
+            Tuple[bool, Optional[int]]: True if the file has to be encoded to MP3, False if it can be uploaded in its own
+                format, and the bitrate that was read for a file uploaded in its own format (None otherwise).
+
+        Raises:
+            FileNotFoundError: If the file does not exist.
+            ValueError: If the file format is not supported.
+        """
         # Check if the file exists
         if not os.path.isfile(file_path):
             logging.error(f"File does not exist: {file_path}")
-            return None, remove_mp3
-
-        # Check if the file is already in mp3 format
-        if file_path.lower().endswith(".mp3"):
-            logging.info(f"The file is already in MP3 format: {file_path}")
-            return file_path, remove_mp3
+            raise FileNotFoundError(f"File does not exist: {file_path}")
+
+        # Check if the Whisper API already accepts the file in its compressed form,
+        # recognizing MP3 audio whatever extension the recorder gave it
+        passthrough_formats = (".mp3", ".m4a", ".webm")
+        is_mp3 = SpeechToTextConverter._is_mp3(file_path)
+        if is_mp3 or file_path.lower().endswith(passthrough_formats):
+            # Copied segments keep the source bitrate, so lossless or unknown-bitrate audio is encoded instead
+            MAX_PASSTHROUGH_BIT_RATE = 320_000
+            bit_rate = SpeechToTextConverter._get_bit_rate(file_path)
+            if bit_rate and bit_rate <= MAX_PASSTHROUGH_BIT_RATE:
+                logging.info(f"The file can be uploaded without conversion: {file_path}")
+                return False, bit_rate
+            logging.info(
+                f"The file's bitrate is too high or unknown, it will be encoded to MP3: {file_path}"
+            )
+            return True, None
 
         # Check if the file is in a supported format
-        supported_formats = [".mp4", ".mpeg", ".mpga", ".m4a", ".wav", ".webm"]
-        if not any(file_path.lower().endswith(fmt) for fmt in supported_formats):
+        supported_formats = (".mp4", ".mpeg", ".mpga", ".wav", ".flac", ".ogg")
+        if not file_path.lower().endswith(supported_formats):
             logging.error(f"Unsupported file formats: {file_path}")
-            return None, remove_mp3
-
-        # Convert files to mp3 format
-        try:
-            audio = AudioSegment.from_file(file_path)
-            mp3_path = os.path.splitext(file_path)[0] + ".mp3"
-            audio.export(mp3_path, format="mp3")
-        except Exception as e:
-            logging.error(f"An error occurred while converting the file: {e}")
-            return None, remove_mp3
+            raise ValueError(f"Unsupported file formats: {file_path}")
 
-        logging.info(f"File converted to MP3 format: {mp3_path}")
-        return mp3_path, True
+        logging.info(f"The file will be encoded to MP3 while it is split: {file_path}")
+        return True, None
 
     @staticmethod
-    def _split_audio(mp3_path: str, duration: int = 900) -> str:
+    def _split_audio(
+        file_path: str,
+        output_dir: str,
+        duration: int = 900,
+        encode_mp3: bool = False,
+        bit_rate: Optional[int] = None,
+    ) -> Generator[str, None, None]:
         """
-        Split an audio file into segments and save them as MP3 files.
+        Split an audio file into segments and yield each segment as soon as it has been written.
+
+        The segments are cut by ffmpeg's segment muxer in a single pass. By default it copies the audio frames without
+        decoding or re-encoding them, so every segment keeps the container format of the input file. With encode_mp3,
+        the same pass encodes the audio to small 16 kHz mono VBR MP3 segments. Copied segments are shortened below duration
+        when bit_rate would make them larger than the Whisper API's 25 MB upload limit.
+        Each segment's timestamps restart at zero, so it decodes as a standalone file.
+        ffmpeg reports every finished segment on its segment list, so callers can start processing it right away.
+        Callers that stop iterating early must close() the generator, which kills ffmpeg.
 
         Args:
             file_path (str): The path of the audio file to be split.
-            duration (int, optional): The duration of each audio segment in seconds. Defaults to 900.
+            output_dir (str): The path of the directory where the audio segments are saved.
+            duration (int, optional): The maximum duration of each audio segment in seconds. Defaults to 900.
+            encode_mp3 (bool, optional): If True, the segments are encoded to MP3 instead of copied. Defaults to False.
+            bit_rate (int, optional): The bitrate of the input in bits per second, used to size copied segments.
+                Defaults to None.
 
-        Returns:
-            str: The path of the directory containing the split audio segments.
-        """
-        try:
-            audio_data = AudioSegment.from_file(mp3_path, format="mp3")
-            num_segments = math.ceil(audio_data.duration_seconds / duration)
+        Yields:
+            str: The path of each audio segment, in order.
 
-            output_dir = os.path.join(
-                os.path.dirname(mp3_path),
-                f"{os.path.splitext(os.path.basename(mp3_path))[0]}_segments",
-            )
-            os.makedirs(output_dir, exist_ok=True)
-
-            for i in range(num_segments):
-                start = i * duration * 1000
-                end = (i + 1) * duration * 1000
-                if end > len(audio_data):
-                    end = len(audio_data)
-                segment = audio_data[start:end]
-                output_path = os.path.join(output_dir, f"segment{i+1}.mp3")
-                segment.export(output_path, format="mp3")
-
-            logging.info("Audio split completely. Saved in: %s", output_dir)
-            return output_dir
-        except Exception as e:
-            logging.error(f"Failed to split audio: {e}")
+        Raises:
+            subprocess.CalledProcessError: If ffmpeg fails to split the audio file.
+        """
+        os.makedirs(output_dir, exist_ok=True)
+
+        if encode_mp3:
+            # Whisper works on 16 kHz mono internally, so a small mono VBR MP3 keeps encoding and uploads cheap
+            codec_args = [
+                "-codec:a",
+                "libmp3lame",
+                "-q:a",
+                "6",
+                "-ac",
+                "1",
+                "-ar",
+                "16000",
+            ]
+            extension = ".mp3"
+        else:
+            # Copied segments keep the source bitrate, so shorten them until each one fits under the upload limit
+            MAX_SEGMENT_BYTES = 24_000_000
+            if bit_rate:
+                duration = min(duration, max(1, MAX_SEGMENT_BYTES * 8 // bit_rate))
+            codec_args = ["-c", "copy"]
+            if SpeechToTextConverter._is_mp3(file_path):
+                extension = ".mp3"
+            else:
+                extension = os.path.splitext(file_path)[1].lower()
+
+        # Zero-padded names keep the segments in order when the directory is sorted.
+        # ffmpeg must not read the terminal: keypresses would alter the split, and background jobs would be stopped
+        process = subprocess.Popen(
+            [
+                "ffmpeg",
+                "-nostdin",
+                "-y",
+                "-loglevel",
+                "error",
+                "-i",
+                file_path,
+                "-f",
+                "segment",
+                "-segment_time",
+                str(duration),
+                "-reset_timestamps",
+                "1",
+                "-segment_list",
+                "pipe:1",
+                "-segment_list_type",
+                "flat",
+                "-vn",
+                *codec_args,
+                os.path.join(output_dir, f"segment%03d{extension}"),
+            ],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        with process:
+            try:
+                for line in process.stdout:
+                    if line.strip():
+                        yield os.path.join(output_dir, line.strip())
+            except GeneratorExit:
+                # The caller stopped early, so don't let ffmpeg write segments nobody will upload
+                process.kill()
+                raise
+
+        if process.returncode:
+            logging.error(f"Failed to split audio: {file_path}")
+            raise subprocess.CalledProcessError(process.returncode, process.args)
+        logging.info("Audio split completely. Saved in: %s", output_dir)
 
     @staticmethod
-    def _clear_tempfile(audios_dir: str, mp3_path: str, remove_flag: bool) -> None:
+    def _clear_tempfile(audios_dir: str) -> None:
         """
         Clear temporary audio files and directories.
 
         Args:
             audios_dir (str): The path of the directory containing temporary audio segment files.
-            mp3_path (str): The path of the temporary MP3 audio file.
-            remove_flag (bool): A flag indicating whether to remove the MP3 audio file.
 
         Returns:
             None
         """
         try:
-            if remove_flag:
-                os.remove(mp3_path)
-                logging.info(f"Successfully removed temporary MP3 file: {mp3_path}")
             shutil.rmtree(audios_dir)
             logging.info(
                 f"Successfully removed temporary audio directory: {audios_dir}"
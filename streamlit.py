@@ -23,6 +23,7 @@ Note:
 """
 
 import os
+import shutil
 import logging
 
 from PIL import Image
@@ -144,11 +145,13 @@ def st_interface():
     if uploaded_file is not None and file_path is not None:
         file_path = os.path.join("/tmp", uploaded_file.name)
         with open(file_path, "wb") as f:
-            f.write(uploaded_file.getvalue())
+            uploaded_file.seek(0)
+            shutil.copyfileobj(uploaded_file, f, length=1024 * 1024)
     else:
         transcript_path = os.path.join("/tmp", uploaded_file.name)
         with open(transcript_path, "wb") as f:
-            f.write(uploaded_file.getvalue())
+            uploaded_file.seek(0)
+            shutil.copyfileobj(uploaded_file, f, length=1024 * 1024)
 
     # Select model
     audio_model = st.selectbox(
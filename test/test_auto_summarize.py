@@ -75,3 +75,38 @@ def test_generate_report_with_error(mocker):
 
     with pytest.raises(OpenAIError):
         generator.generate_report(meeting_transcript)
+
+
+def test_best_choice_split_balances_chunks():
+    generator = ReportGenerator.__new__(ReportGenerator)
+    generator.model_limit = 2200
+    transcript = "這是一段會議逐字稿。" * 700
+
+    chunks, pass_limit = generator._best_choice_split(split_data=transcript)
+
+    sizes = [len(generator._get_encoding("gpt-3.5-turbo-0613").encode(c)) for c in chunks]
+    assert not pass_limit
+    assert len(chunks) > 1
+    assert max(sizes) <= 1010
+    assert max(sizes) - min(sizes) <= 20
+
+
+def test_get_model_limit_from_table(mocker):
+    mock_processor = mocker.patch("src.auto_summarize.ParallelProcessor")
+    generator = ReportGenerator(transcript="", model="gpt-4", api_key="sk-test")
+
+    assert generator.model_limit == 8192 - 100
+    mock_processor.return_value.parallel_request.assert_not_called()
+
+
+def test_preprocess_chunks_dedup(mocker):
+    generator = ReportGenerator.__new__(ReportGenerator)
+    mock_request = mocker.patch.object(
+        generator, "_openai_parallel_request", return_value=["摘要A", "摘要B"]
+    )
+
+    summaries = generator._preprocess_chunks(["開場", "議題", "開場"])
+
+    assert summaries == ["摘要A", "摘要B", "摘要A"]
+    mock_request.assert_called_once()
+    assert len(mock_request.call_args.kwargs["prompt_list"]) == 2
@@ -7,8 +7,13 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")
 from src.export_records import ReportExporter
 
 
-def test_export_txt(tmpdir):
-    output_directory = str(tmpdir)
+@pytest.fixture(scope="module")
+def out_dir(tmp_path_factory):
+    return tmp_path_factory.mktemp("exports")
+
+
+def test_export_txt(out_dir):
+    output_directory = str(out_dir)
     exporter = ReportExporter(output_directory)
 
     meeting_name = "Meeting 1"
@@ -26,8 +31,8 @@ def test_export_txt(tmpdir):
         assert summary in content
 
 
-def test_export_doc(tmpdir):
-    output_directory = str(tmpdir)
+def test_export_doc(out_dir):
+    output_directory = str(out_dir)
     exporter = ReportExporter(output_directory)
 
     meeting_name = "Meeting 1"
@@ -45,8 +50,8 @@ def test_export_doc(tmpdir):
         assert summary in content
 
 
-def test_export_pdf(tmpdir):
-    output_directory = str(tmpdir)
+def test_export_pdf(out_dir):
+    output_directory = str(out_dir)
     exporter = ReportExporter(output_directory)
 
     meeting_name = "Meeting 1"
@@ -58,8 +63,8 @@ def test_export_pdf(tmpdir):
     assert os.path.exists(expected_file_path)
 
 
-def test_export_json(tmpdir):
-    output_directory = str(tmpdir)
+def test_export_json(out_dir):
+    output_directory = str(out_dir)
     exporter = ReportExporter(output_directory)
 
     meeting_name = "Meeting 1"
@@ -1,7 +1,10 @@
 import os
 import sys
+import time
+import threading
 import pytest
 from unittest.mock import patch
+from concurrent.futures import ThreadPoolExecutor
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 from src.speech_to_text import SpeechToTextConverter
@@ -69,3 +72,157 @@ def test_speech_to_text_oss(mocker, converter, mock_file_path):
     assert result == expected_transcript
 
     mock_transcribe.assert_called_once_with(file_path)
+
+
+def test_is_mp3_sniffs_header(tmpdir):
+    id3_file = tmpdir.join("tagged.wav")
+    # ID3v2 tag of 128 bytes (syncsafe size 0x00 0x00 0x01 0x00), then an MP3 frame
+    id3_file.write_binary(
+        b"ID3\x04\x00\x00\x00\x00\x01\x00" + b"\x00" * 128 + b"\xff\xfb\x90\x00"
+    )
+    id3_aac_file = tmpdir.join("tagged.aac")
+    id3_aac_file.write_binary(
+        b"ID3\x04\x00\x00\x00\x00\x00\x05TALB\x00" + b"\xff\xf1\x50\x80"
+    )
+    frame_file = tmpdir.join("untagged.wav")
+    frame_file.write_binary(b"\xff\xfb\x90\x00")
+    aac_file = tmpdir.join("adts.m4a")
+    aac_file.write_binary(b"\xff\xf1\x50\x80")
+    wav_file = tmpdir.join("real.wav")
+    wav_file.write_binary(b"RIFF\x24\x00\x00\x00WAVE")
+
+    assert SpeechToTextConverter._is_mp3(str(id3_file))
+    assert not SpeechToTextConverter._is_mp3(str(id3_aac_file))
+    assert SpeechToTextConverter._is_mp3(str(frame_file))
+    assert not SpeechToTextConverter._is_mp3(str(aac_file))
+    assert not SpeechToTextConverter._is_mp3(str(wav_file))
+
+
+def test_whisper_model_singleton(mocker):
+    fake_whisper = mocker.MagicMock()
+    mocker.patch.dict(sys.modules, {"whisper": fake_whisper})
+    SpeechToTextConverter._load_whisper_model.cache_clear()
+
+    first = SpeechToTextConverter._load_whisper_model("base", "/models")
+    second = SpeechToTextConverter._load_whisper_model("base", "/models")
+
+    assert first is second
+    assert first[0] is fake_whisper.load_model.return_value
+    fake_whisper.load_model.assert_called_once_with("base", download_root="/models")
+    SpeechToTextConverter._load_whisper_model.cache_clear()
+
+
+def test_whisper_model_transcriptions_are_serialized(mocker):
+    running = []
+    max_running = []
+
+    def transcribe(file_path):
+        running.append(file_path)
+        max_running.append(len(running))
+        time.sleep(0.05)
+        running.remove(file_path)
+        return {"text": file_path}
+
+    fake_model = mocker.MagicMock()
+    fake_model.transcribe.side_effect = transcribe
+    mocker.patch.object(
+        SpeechToTextConverter,
+        "_load_whisper_model",
+        return_value=(fake_model, threading.Lock()),
+    )
+
+    results = {}
+
+    def convert(file_path):
+        converter = SpeechToTextConverter.__new__(SpeechToTextConverter)
+        converter.file_path = file_path
+        converter.save_transcript = False
+        results[file_path] = converter._convert_by_model(model="base")
+
+    threads = [threading.Thread(target=convert, args=(p,)) for p in ("a.wav", "b.wav")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == {"a.wav": "a.wav", "b.wav": "b.wav"}
+    assert max(max_running) == 1
+
+
+def test_split_audio_shortens_copied_segments_by_bitrate(mocker, tmpdir):
+    audio_file = tmpdir.join("loud.mp3")
+    audio_file.write_binary(b"ID3\x04\x00\x00")
+    mock_probe = mocker.patch.object(SpeechToTextConverter, "_get_bit_rate")
+    mock_popen = mocker.patch("src.speech_to_text.subprocess.Popen")
+    mock_popen.return_value.stdout = ["segment000.mp3\n"]
+    mock_popen.return_value.returncode = 0
+
+    segments = list(
+        SpeechToTextConverter._split_audio(
+            str(audio_file), str(tmpdir.join("out")), bit_rate=320000
+        )
+    )
+
+    args = mock_popen.call_args.args[0]
+    assert args[args.index("-segment_time") + 1] == "600"
+    assert args[args.index("-c") + 1] == "copy"
+    assert segments == [str(tmpdir.join("out", "segment000.mp3"))]
+    mock_probe.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "bit_rate, expected",
+    [(256000, (False, 256000)), (1411000, (True, None)), (None, (True, None))],
+)
+def test_needs_mp3_encoding_checks_passthrough_bitrate(
+    mocker, tmpdir, bit_rate, expected
+):
+    audio_file = tmpdir.join("meeting.m4a")
+    audio_file.write_binary(b"\x00\x00\x00\x20ftypM4A ")
+    mocker.patch.object(SpeechToTextConverter, "_get_bit_rate", return_value=bit_rate)
+
+    assert SpeechToTextConverter._needs_mp3_encoding(str(audio_file)) == expected
+
+
+def test_convert_by_api_stops_and_cleans_up_after_failed_upload(mocker, tmpdir):
+    audio_file = tmpdir.join("meeting.mp3")
+    audio_file.write_binary(b"ID3\x04\x00\x00")
+    segment_dir = tmpdir.join("meeting_segments")
+    split_closed = []
+    upload_finished = threading.Event()
+
+    class SignallingExecutor(ThreadPoolExecutor):
+        def submit(self, *args, **kwargs):
+            future = super().submit(*args, **kwargs)
+            # Done callbacks run once the future has its exception set
+            future.add_done_callback(lambda _: upload_finished.set())
+            return future
+
+    def split_audio(file_path, output_dir, encode_mp3=False, bit_rate=None):
+        os.makedirs(output_dir, exist_ok=True)
+        try:
+            yield os.path.join(output_dir, "segment000.mp3")
+            # Hand out the next segment only after the first upload has failed
+            upload_finished.wait(timeout=5)
+            yield os.path.join(output_dir, "segment001.mp3")
+        finally:
+            split_closed.append(True)
+
+    converter = SpeechToTextConverter.__new__(SpeechToTextConverter)
+    converter.file_path = str(audio_file)
+    converter.client = mocker.MagicMock()
+    mocker.patch("src.speech_to_text.ThreadPoolExecutor", SignallingExecutor)
+    mocker.patch.object(
+        converter, "_needs_mp3_encoding", return_value=(False, 128000)
+    )
+    mocker.patch.object(converter, "_split_audio", side_effect=split_audio)
+    mock_transcribe = mocker.patch.object(
+        converter, "_transcribe_segment", side_effect=RuntimeError("413")
+    )
+
+    with pytest.raises(RuntimeError):
+        converter._convert_by_api()
+
+    assert mock_transcribe.call_count == 1
+    assert split_closed
+    assert not os.path.exists(str(segment_dir))